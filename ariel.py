@@ -9,34 +9,183 @@ import argparse
 import subprocess
 import threading
 import logging
-from datetime import datetime
+import time
+import hashlib
+import gzip
 from pathlib import Path
-from flask import Flask, render_template, jsonify, request, make_response
+from flask import Flask, Response, render_template, request, make_response
 from werkzeug.http import http_date, parse_date
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from waitress import serve
 
 app = Flask(__name__)
 
 # Disable Flask/Werkzeug logging
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
+logging.getLogger('waitress').setLevel(logging.ERROR)
 app.logger.disabled = True
 
 # Global configuration
 config = {
     'mmd_file': None,
+    'mmd_path': None,
     'last_modified': None,
-    'last_content': None
+    'last_content': None,
+    'last_content_bytes': None,
+    'last_content_gzip': None,
+    'etag': None,
+    'etag_gzip': None,
+    'error': None,
+    'version': 0
 }
 
+# Guards the cached file state in config; notified whenever it changes
+config_changed = threading.Condition(threading.Lock())
+
+# Worker threads for the production server; each open /mermaid/stream holds one
+SERVER_THREADS = 32
+
+# Open streams allowed at once; the remaining threads stay free for / and /mermaid
+MAX_STREAMS = 24
+
+# Number of open /mermaid/stream connections, guarded by config_changed
+open_streams = 0
+
+# Send a comment line this often so dead stream connections get noticed (seconds)
+STREAM_KEEPALIVE_INTERVAL = 15
+
+# How often a waiting stream checks whether its client has gone away (seconds)
+STREAM_DISCONNECT_CHECK = 1
+
+# Smaller diagrams are sent uncompressed; gzip overhead isn't worth it (bytes)
+GZIP_MIN_SIZE = 500
+GZIP_LEVEL = 6
+
+# Rendered main page per filename: (body bytes, ETag)
+index_cache = {}
+
+# Wait this long after the last watcher event before reloading, so a save that
+# truncates and then writes isn't pushed to clients half-written (seconds)
+RELOAD_DEBOUNCE = 0.1
+
+# Watcher events that mean the file content may have changed
+WATCHED_EVENT_TYPES = {'created', 'modified', 'moved', 'deleted', 'closed'}
+
+
+def load_file():
+    """
+    Read the mermaid file into the cache in config.
+    Called once at startup and then by the file watcher whenever the file
+    changes, so request handlers never have to touch the filesystem.
+    """
+    mmd_path = config['mmd_path']
+    content = None
+    content_bytes = None
+    content_gzip = None
+    last_modified = None
+    etag = None
+    etag_gzip = None
+    error = None
+
+    try:
+        # A single stat() both checks the file exists and gives mtime/size
+        stat = mmd_path.stat()
+        # Create ETag from the file's mtime and size so it needs no read or hash
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        with config_changed:
+            # Same mtime and size as the cached copy: skip the read
+            if etag == config['etag'] and config['error'] is None:
+                return
+        # Keep the raw bytes for /mermaid so responses need no re-encoding;
+        # the decoded text is only needed for the event stream
+        with open(mmd_path, 'rb') as f:
+            content_bytes = f.read()
+        content = content_bytes.decode('utf-8')
+        # Compress once per change so every gzip-capable request can reuse it
+        if len(content_bytes) >= GZIP_MIN_SIZE:
+            content_gzip = gzip.compress(content_bytes, compresslevel=GZIP_LEVEL)
+            # A different content-coding is a different representation, so it needs its own strong ETag
+            etag_gzip = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-gz"'
+        # Format the Last-Modified header once per change, not per request
+        last_modified = http_date(stat.st_mtime)
+    except FileNotFoundError:
+        error = (f'Mermaid file not found: {config["mmd_file"]}', 404)
+    except Exception as e:
+        error = (f'Failed to read file: {str(e)}', 500)
+
+    if error:
+        content = None
+        content_bytes = None
+        content_gzip = None
+        last_modified = None
+        etag = None
+        etag_gzip = None
+
+    with config_changed:
+        # Only announce real changes, e.g. not the same missing file twice
+        if etag == config['etag'] and error == config['error']:
+            return
+        config['last_content'] = content
+        config['last_content_bytes'] = content_bytes
+        config['last_content_gzip'] = content_gzip
+        config['last_modified'] = last_modified
+        config['etag'] = etag
+        config['etag_gzip'] = etag_gzip
+        config['error'] = error
+        config['version'] += 1
+        config_changed.notify_all()
+
+
+class MermaidFileHandler(FileSystemEventHandler):
+    """Reload the mermaid file once the watcher's events for it settle down"""
+
+    def __init__(self, mmd_path):
+        super().__init__()
+        self.mmd_path = os.fsdecode(mmd_path)
+        self.reload_timer = None
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in WATCHED_EVENT_TYPES:
+            return
+        # Editors that save via rename show up as a move onto our file
+        paths = {os.fsdecode(event.src_path), os.fsdecode(getattr(event, 'dest_path', ''))}
+        if self.mmd_path in paths:
+            # Restart the timer on every event; reload when they stop arriving
+            if self.reload_timer is not None:
+                self.reload_timer.cancel()
+            self.reload_timer = threading.Timer(RELOAD_DEBOUNCE, load_file)
+            self.reload_timer.daemon = True
+            self.reload_timer.start()
+
 
 @app.route('/')
 def index():
     """Serve the main webpage"""
     if config['mmd_file']:
-        filename = Path(config['mmd_file']).name
+        filename = config['mmd_path'].name
     else:
         filename = 'No file loaded'
-    return render_template('index.html', filename=filename)
+
+    # Render once per filename; debug mode re-renders so template edits show up
+    cached = index_cache.get(filename)
+    if cached is None or app.debug:
+        body = render_template('index.html', filename=filename).encode('utf-8')
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        cached = index_cache[filename] = (body, etag)
+    body, etag = cached
+
+    # Check If-None-Match header (ETag validation)
+    if request.headers.get('If-None-Match') == etag:
+        response = make_response('', 304)
+        response.headers['ETag'] = etag
+        return response
+
+    response = Response(body, mimetype='text/html')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/mermaid')
@@ -44,61 +193,126 @@ def mermaid():
     """
     Return the mermaid diagram content if the file has been modified.
     Returns 304 Not Modified if the file hasn't changed since last request.
-    Uses ETag (content hash) for cache validation.
+    Uses ETag (file mtime and size) for cache validation.
+    Content comes from the cache kept up to date by the file watcher.
     """
     # Check if mmd_file is configured
     if config['mmd_file'] is None:
         return 'No mermaid file configured', 500
 
-    mmd_path = Path(config['mmd_file'])
-
-    # Check if file exists
-    if not mmd_path.exists():
-        return f'Mermaid file not found: {config["mmd_file"]}', 404
+    with config_changed:
+        content_bytes = config['last_content_bytes']
+        content_gzip = config['last_content_gzip']
+        last_modified = config['last_modified']
+        etag = config['etag']
+        etag_gzip = config['etag_gzip']
+        error = config['error']
 
-    # Read the mermaid file
-    try:
-        with open(mmd_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
-        return f'Failed to read file: {str(e)}', 500
+    if error:
+        return error
 
-    # Get file modification time
-    try:
-        file_mtime = datetime.fromtimestamp(mmd_path.stat().st_mtime)
-    except Exception as e:
-        return f'Failed to read file stats: {str(e)}', 500
-
-    # Create ETag from content hash
-    import hashlib
-    etag = f'"{hashlib.md5(content.encode()).hexdigest()}"'
-
-    # Check If-None-Match header (ETag validation)
+    # Check If-None-Match header (ETag validation); either encoding's tag
+    # means the client already has the current version
     if_none_match = request.headers.get('If-None-Match')
-    if if_none_match and if_none_match == etag:
+    if if_none_match and if_none_match in (etag, etag_gzip):
         # Content hasn't changed
         response = make_response('', 304)
-        response.headers['ETag'] = etag
-        response.headers['Last-Modified'] = http_date(file_mtime.timestamp())
+        response.headers['ETag'] = if_none_match
+        response.headers['Last-Modified'] = last_modified
+        response.headers['Vary'] = 'Accept-Encoding'
         return response
 
-    # Update cache
-    config['last_modified'] = file_mtime
-    config['last_content'] = content
-
-    # Return the raw content
-    response = make_response(content)
+    # Return the raw content, gzipped if the client accepts it
+    if content_gzip is not None and request.accept_encodings['gzip']:
+        response = make_response(content_gzip)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['ETag'] = etag_gzip
+    else:
+        response = make_response(content_bytes)
+        response.headers['ETag'] = etag
     response.headers['Content-Type'] = 'text/plain; charset=utf-8'
-    response.headers['ETag'] = etag
-    response.headers['Last-Modified'] = http_date(file_mtime.timestamp())
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Last-Modified'] = last_modified
     response.headers['Cache-Control'] = 'no-cache'
 
     return response
 
 
+def format_sse(data, event=None):
+    """
+    Format a Server-Sent Event.
+    Each line of data gets its own 'data:' field so multi-line diagrams
+    survive intact; the browser joins them back together with newlines.
+    """
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    for line in data.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        lines.append(f'data: {line}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@app.route('/mermaid/stream')
+def mermaid_stream():
+    """
+    Stream the mermaid diagram content as Server-Sent Events.
+    Sends the content on connect and again whenever the file watcher
+    reports a change. File problems are sent as 'file-error' events.
+    Returns 503 once MAX_STREAMS are open; the page retries with backoff.
+    """
+    global open_streams
+
+    # Check if mmd_file is configured
+    if config['mmd_file'] is None:
+        return 'No mermaid file configured', 500
+
+    # Each stream holds a server thread, so cap them before they starve other requests
+    with config_changed:
+        if open_streams >= MAX_STREAMS:
+            return f'Too many open streams (limit {MAX_STREAMS})', 503
+        open_streams += 1
+
+    def close_stream():
+        global open_streams
+        with config_changed:
+            open_streams -= 1
+
+    # Only set by waitress when channel_request_lookahead is enabled
+    client_disconnected = request.environ.get('waitress.client_disconnected')
+
+    def generate():
+        version = None
+
+        while True:
+            with config_changed:
+                # Wait in short slices so a closed tab frees its thread promptly
+                deadline = time.monotonic() + STREAM_KEEPALIVE_INTERVAL
+                while config['version'] == version and time.monotonic() < deadline:
+                    if client_disconnected is not None and client_disconnected():
+                        return
+                    config_changed.wait(timeout=STREAM_DISCONNECT_CHECK)
+
+                if config['version'] == version:
+                    # Comment line keeps proxies happy and lets us notice closed connections
+                    message = ': keepalive\n\n'
+                else:
+                    version = config['version']
+                    if config['error']:
+                        message = format_sse(config['error'][0], event='file-error')
+                    else:
+                        message = format_sse(config['last_content'])
+
+            yield message
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(close_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def open_browser(url, delay=1.5):
     """Open web browser using the system's open command"""
-    import time
     time.sleep(delay)
     try:
         # Use platform-specific open command
@@ -148,12 +362,21 @@ def main():
 
     # Update global config
     config['mmd_file'] = args.file
+    config['mmd_path'] = Path(args.file)
 
     # Check if mermaid file exists
-    if not Path(args.file).exists():
+    if not config['mmd_path'].exists():
         print(f'Error: Mermaid file not found: {args.file}', file=sys.stderr)
         sys.exit(1)
 
+    # Load the file and watch its directory for changes (inotify, FSEvents, ...)
+    load_file()
+    mmd_path = config['mmd_path'].resolve()
+    observer = Observer()
+    observer.schedule(MermaidFileHandler(mmd_path), str(mmd_path.parent), recursive=False)
+    observer.daemon = True
+    observer.start()
+
     # Construct URL
     url = f'http://{args.host}:{args.port}'
 
@@ -168,14 +391,24 @@ def main():
     if not args.no_browser:
         threading.Thread(target=open_browser, args=(url,), daemon=True).start()
 
-    # Run the Flask app
-    app.run(
-        host=args.host,
-        port=args.port,
-        debug=args.debug,
-        use_reloader=False,
-        threaded=True
-    )
+    # Run the Flask app (development server only in debug mode)
+    if args.debug:
+        app.run(
+            host=args.host,
+            port=args.port,
+            debug=args.debug,
+            use_reloader=False,
+            threaded=True
+        )
+    else:
+        # Request lookahead lets waitress tell streams when their client disconnects
+        serve(
+            app,
+            host=args.host,
+            port=args.port,
+            threads=SERVER_THREADS,
+            channel_request_lookahead=1
+        )
 
 
 if __name__ == '__main__':
@@ -117,15 +117,15 @@ else
     fi
     PYTHON_CMD="python3"
 
-    # Check if Flask is installed
-    if ! python3 -c "import flask" 2>/dev/null; then
-        echo -e "${YELLOW}Warning: Flask is not installed${NC}"
-        echo -e "Install it with: pip install flask"
+    # Check if Flask, watchdog and waitress are installed
+    if ! python3 -c "import flask, watchdog, waitress" 2>/dev/null; then
+        echo -e "${YELLOW}Warning: Flask, watchdog or waitress is not installed${NC}"
+        echo -e "Install them with: pip install -r requirements.txt"
         echo -e "Or create a virtual environment: python3 -m venv venv && source venv/bin/activate && pip install -r requirements.txt"
-        echo -e "Attempting to install Flask..."
-        pip install flask || {
-            echo -e "${RED}Error: Failed to install Flask${NC}"
-            echo -e "Please install Flask manually: pip install flask"
+        echo -e "Attempting to install dependencies..."
+        pip install -r "$SCRIPT_DIR/requirements.txt" || {
+            echo -e "${RED}Error: Failed to install dependencies${NC}"
+            echo -e "Please install them manually: pip install -r requirements.txt"
             exit 1
         }
     fi